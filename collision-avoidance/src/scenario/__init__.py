@@ -0,0 +1 @@
+from scenario import *
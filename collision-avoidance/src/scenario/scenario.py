@@ -0,0 +1,90 @@
+from random import random, choice
+
+import numpy as np
+
+# Turning actions, with their codes and steering angles
+STRAIGHT, LEFT, RIGHT = range(3)
+DIRECTIONS = np.array([0, np.pi/2, -np.pi/2])
+
+class Scenario(object):
+    '''
+    Grid of 4-way intersections that robots enter and cross
+
+    Inputs:
+        - rows: number of horizontal roads
+        - cols: number of vertical roads
+        - spacing: distance between adjacent intersections (m)
+        - R: length of the roads beyond the outermost intersections (m)
+        - w: road width (m)
+        - prob: probability of a robot entering each time step, if rates is not given
+        - rates: arrival rate (robots/s) of every entrance, or a list with one per entrance
+        - turn_probs: probabilities of going straight, turning left and turning right
+    '''
+    def __init__(self, rows=1, cols=1, spacing=100, R=200, w=7, prob=0.04, rates=None, turn_probs=(0.5, 0.25, 0.25)):
+        self.rows, self.cols = int(rows), int(cols)
+        self.spacing = float(spacing)
+        self.R, self.w = float(R), float(w)
+        self.prob = float(prob)
+        self.turn_probs = turn_probs
+        # Lay out roads, centered on the origin
+        self.xs = [(j - (self.cols - 1)/2.) * self.spacing for j in range(self.cols)]
+        self.ys = [(i - (self.rows - 1)/2.) * self.spacing for i in range(self.rows)]
+        self._init_entrances()
+        # Set arrival rates, if any
+        if rates is None:
+            self.rates = None
+        elif hasattr(rates, '__iter__'):
+            assert(len(rates) == len(self.entrances))
+            self.rates = np.array(rates, dtype=float)
+        else:
+            self.rates = float(rates) * np.ones(len(self.entrances))
+
+    def _init_entrances(self):
+        '''Creates the entrances at the ends of every road'''
+        x_max, y_max = self.xs[-1] + self.R, self.ys[-1] + self.R
+        x_min, y_min = self.xs[0] - self.R, self.ys[0] - self.R
+        # Each entrance is a road end, the direction into the grid and the road's intersections
+        self.entrances = []
+        self.entrances += [((x_max, y), (-1, 0), [(x, y) for x in reversed(self.xs)]) for y in self.ys]
+        self.entrances += [((x, y_max), (0, -1), [(x, y) for y in reversed(self.ys)]) for x in self.xs]
+        self.entrances += [((x_min, y), (1, 0), [(x, y) for x in self.xs]) for y in self.ys]
+        self.entrances += [((x, y_min), (0, 1), [(x, y) for y in self.ys]) for x in self.xs]
+
+    def single(self):
+        '''Returns if the scenario is a single intersection'''
+        return self.rows == 1 and self.cols == 1
+
+    def intersections(self):
+        '''Centers of every intersection'''
+        return [(x, y) for y in self.ys for x in self.xs]
+
+    def bounds(self):
+        '''Extent of the roads, as (x_min, x_max, y_min, y_max)'''
+        return self.xs[0] - self.R, self.xs[-1] + self.R, self.ys[0] - self.R, self.ys[-1] + self.R
+
+    def exited(self, pos, vel, margin=0):
+        '''Returns if the robot is beyond the extent of the roads and moving away'''
+        x_min, x_max, y_min, y_max = self.bounds()
+        (x, y), (vx, vy) = pos, vel
+        return ((x > x_max + margin and vx > 0) or (x < x_min - margin and vx < 0) or
+                (y > y_max + margin and vy > 0) or (y < y_min - margin and vy < 0))
+
+    def arrivals(self, dt):
+        '''Returns the entrances that robots arrive at during the time step, with repeats'''
+        # Bernoulli arrivals at a random entrance
+        if self.rates is None:
+            return [choice(self.entrances)] if random() <= self.prob else []
+        # Poisson arrivals at every entrance
+        counts = np.random.poisson(self.rates * dt)
+        return [entrance for entrance, k in zip(self.entrances, counts) for _ in range(k)]
+
+    def spawn(self, entrance, offset=0):
+        '''Position, direction, turning action and turning intersection of a robot entering'''
+        end, direction, centers = entrance
+        # Drive in the right lane, offset behind the road end
+        right = (direction[1], -direction[0])
+        pos = tuple(e + self.w/4 * r - offset * d for e, r, d in zip(end, right, direction))
+        # Determine turning action and where to take it
+        action, = np.random.choice(len(DIRECTIONS), 1, p=self.turn_probs)
+        center = centers[np.random.randint(len(centers))] if len(centers) > 1 else centers[0]
+        return pos, direction, action, center
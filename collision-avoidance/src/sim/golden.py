@@ -0,0 +1,94 @@
+from random import seed as py_seed
+
+import numpy as np
+
+from scenario import Scenario
+from sim import Simulation
+
+# Scenarios to record, as the arguments of Simulation and of its Scenario, if any
+SCENARIOS = {
+    'default': dict(prob=0.1),
+    'turning': dict(prob=0.2, turning=True),
+    'grid': dict(prob=0, T=30, turning=True, scenario=dict(rows=2, cols=2, rates=0.2)),
+}
+SEEDS = (0, 1, 2)
+
+def _run(make_sim, scenario, seed):
+    '''Runs the scenario tick by tick, returning the agents' positions and the collisions'''
+    py_seed(seed)
+    np.random.seed(seed)
+    kwargs = dict(scenario)
+    if 'scenario' in kwargs:
+        kwargs['scenario'] = Scenario(prob=kwargs['prob'], **kwargs['scenario'])
+    sim = make_sim(**kwargs)
+    positions, collisions = [], []
+    for _ in sim.ts:
+        sim._control_loop()
+        positions.append([sim.sim.getAgentPosition(agent) for agent in range(sim.sim.getNumAgents())])
+        collisions.append(sim.collisions)
+    # Pad positions of agents not yet added
+    N = max(len(p) for p in positions) if positions else 0
+    padded = np.nan * np.ones((N, len(positions), 2))
+    for tick, p in enumerate(positions):
+        padded[:len(p), tick] = np.reshape(p, (-1, 2))
+    return padded, np.array(collisions)
+
+def record(fname, make_sim=Simulation, scenarios=SCENARIOS, seeds=SEEDS):
+    '''Records the reference positions and collisions of every scenario and seed'''
+    golden = {}
+    for name, scenario in sorted(scenarios.items()):
+        for seed in seeds:
+            print 'Recording {} (seed {})'.format(name, seed)
+            key = '{}-{}'.format(name, seed)
+            golden[key + '__positions'], golden[key + '__collisions'] = _run(make_sim, scenario, seed)
+    np.savez_compressed(fname, **golden)
+
+def _pad(states, N, T):
+    '''Pads or truncates the states to N agents and T ticks, marking missing agents with NaN'''
+    padded = np.nan * np.ones((N, T) + states.shape[2:])
+    padded[:states.shape[0]] = states[:, :T]
+    return padded
+
+def _first_divergence(ref, alt, atol):
+    '''First tick and agent where the positions differ by more than the tolerance, if any'''
+    # Compare the ticks of both runs, with agents missing from either as NaN
+    N, T = max(len(ref), len(alt)), min(ref.shape[1], alt.shape[1])
+    missing = ref.shape[1] != alt.shape[1]
+    ref, alt = _pad(ref, N, T), _pad(alt, N, T)
+    bad = np.any(~np.isclose(ref, alt, rtol=0, atol=atol, equal_nan=True), axis=2)
+    if not np.any(bad):
+        # Ticks missing from either run diverge from the first of them
+        return (T + 1, None) if missing else None
+    tick = np.flatnonzero(np.any(bad, axis=0))[0]
+    return tick + 1, np.flatnonzero(bad[:, tick])[0]
+
+def compare(fname, make_sim=Simulation, scenarios=SCENARIOS, atol=1e-9):
+    '''
+    Replays every recorded scenario with the simulation and compares it to the reference
+
+    Returns a list of (scenario-seed, quantity, tick, agent) for each divergence, where the tick
+    and agent are the first to differ by more than the tolerance, or the first tick missing from
+    either run. Tick t is after t time steps.
+    '''
+    golden = np.load(fname)
+    divergences = []
+    for key in sorted(set(k.split('__')[0] for k in golden.files)):
+        name, seed = key.rsplit('-', 1)
+        positions, collisions = _run(make_sim, scenarios[name], int(seed))
+        found = []
+        # Compare positions
+        divergence = _first_divergence(golden[key + '__positions'], positions, atol)
+        if divergence:
+            found.append((key, 'position') + divergence)
+        # Compare collisions, counted at the end of each tick
+        ref = golden[key + '__collisions']
+        T = min(len(ref), len(collisions))
+        diff = np.flatnonzero(ref[:T] != collisions[:T])
+        if len(diff) or len(ref) != len(collisions):
+            found.append((key, 'collisions', (diff[0] if len(diff) else T) + 1, None))
+        for _, quantity, tick, agent in found:
+            print '{}: {} diverged at tick {}{}'.format(key, quantity, tick, '' if agent is None else ', agent {}'.format(agent))
+        if not found:
+            print '{}: ok'.format(key)
+        divergences.extend(found)
+    return divergences
@@ -1,8 +1,7 @@
 from matplotlib.animation import FuncAnimation
 from matplotlib.patches import Circle, Rectangle
-from random import random, choice, uniform
-from itertools import combinations
 from numpy.linalg import norm
+from scenario import Scenario, STRAIGHT, LEFT, RIGHT, DIRECTIONS
 from util import *
 
 import rvo2
@@ -21,19 +20,35 @@ class Simulation(object):
         - T: end time (s)
         - dt: time step (s)
         - turning: enable robots to turn at the intersection
+        - scenario: intersections and arrivals, defaults to a single intersection of radius R
     '''
-    def __init__(self, prob, vmax=20, w=7, r=2, R=200, T=60, dt=0.2, turning=False):
-        self.prob = float(prob)
+    def __init__(self, prob, vmax=20, w=7, r=2, R=200, T=60, dt=0.2, turning=False, scenario=None):
+        self.scenario = scenario or Scenario(R=R, w=w, prob=prob)
+        self.prob = self.scenario.prob
         self.vmax = float(vmax)
-        self.w = float(w)
+        self.w = self.scenario.w
         self.T, self.dt = float(T), float(dt)
         self.ts = np.arange(0, self.T, self.dt)
-        self.r, self.R = r, R
+        self.r, self.R = r, self.scenario.R
         self.turning = turning
         self.collisions = 0
-        self.not_acted = set()
-        self.actions = []
+        # Turning action, turning intersection and whether yet to act, of every agent
+        self.actions = np.zeros(0, dtype=int)
+        self.centers = np.zeros((0, 2))
+        self.not_acted = np.zeros(0, dtype=bool)
         self.bodies = []
+        # Agents on the roads, and retired agents available for reuse
+        self.active = set()
+        self.parked = []
+        self.spawned = 0
+        self.t = 0
+        # Entry time, last position and distance travelled of every agent
+        self.entry_times = np.zeros(0)
+        self.positions = np.zeros((0, 2))
+        self.distances = np.zeros(0)
+        # Entry time, exit time and distance travelled of every agent that crossed
+        self.crossings = np.zeros((0, 3))
+        self.crossed = 0
         self._init_rvo()
 
     def _init_rvo(self, neighborDist=1.5, maxNeighbors=5, timeHorizon=1.5, timeHorizonObst=2):
@@ -44,88 +59,139 @@ class Simulation(object):
         '''Initialize the animation's figure'''
         # Create plot
         self.fig, self.ax = plt.subplots()
-        self.ax.set_xlim(-self.R, self.R)
-        self.ax.set_ylim(-self.R, self.R)
+        x_min, x_max, y_min, y_max = self.scenario.bounds()
+        self.ax.set_xlim(x_min, x_max)
+        self.ax.set_ylim(y_min, y_max)
         self.ax.set_aspect(1)
         # Draw environment
-        self.ax.add_patch(Circle((0, 0), self.R, color='black', linewidth=3, alpha=0.25))
+        if self.scenario.single():
+            self.ax.add_patch(Circle((0, 0), self.R, color='black', linewidth=3, alpha=0.25))
+        else:
+            self.ax.add_patch(Rectangle((x_min, y_min), x_max - x_min, y_max - y_min, color='black', linewidth=3, alpha=0.25))
         # Draw roads and lanes
-        xy, wh = (-self.R, -self.w/2), (2*self.R, self.w)
         col, lw, a = 'white', 0, 1
-        self.ax.add_patch(Rectangle(xy, *wh, color=col, linewidth=lw, alpha=a))
-        self.ax.add_patch(Rectangle(list(reversed(xy)), *list(reversed(wh)), color=col, linewidth=lw, alpha=a))
-        xx, yy = (-self.R, self.R), (0, 0)
+        for y in self.scenario.ys:
+            self.ax.add_patch(Rectangle((x_min, y - self.w/2), x_max - x_min, self.w, color=col, linewidth=lw, alpha=a))
+        for x in self.scenario.xs:
+            self.ax.add_patch(Rectangle((x - self.w/2, y_min), self.w, y_max - y_min, color=col, linewidth=lw, alpha=a))
         col, lw = 'blue', 0.5
-        self.ax.plot(xx, yy, '--', color=col, linewidth=lw)
-        self.ax.plot(yy, xx, '--', color=col, linewidth=lw)
+        for y in self.scenario.ys:
+            self.ax.plot((x_min, x_max), (y, y), '--', color=col, linewidth=lw)
+        for x in self.scenario.xs:
+            self.ax.plot((x, x), (y_min, y_max), '--', color=col, linewidth=lw)
         # Set time label
         self.time_label = self.ax.text(0.02, 0.95, '', transform=self.ax.transAxes)
         plt.title('Collision Avoidance')
 
-    def _control_loop(self):
-        '''Control loop for the agents'''
-        # Update agents
-        self.sim.doStep()
-        # Add new agent, if applicable
-        if random() <= self.prob:
-            # Determine entrance
-            entrances = [(self.R, 0), (0, self.R), (-self.R, 0), (0, -self.R)]
-            entrance = choice(entrances)
-            # Determine position and velocity
-            theta0 = np.arctan2(*reversed(entrance))
-            theta = np.arctan(self.w/(2*self.R))
-            pos = pol2cart((self.R, theta0 + theta/2))
-            vel_raw = [-i for i in entrance]
-            vel = tuple(scale(vel_raw, self.vmax))
-            # Determine turning action
-            actions = ['straight', 'left', 'right']
-            probabilities = [0.5, 0.25, 0.25]
-            action, = np.random.choice(actions, 1, p=probabilities)
-            self.actions.append(action)
-            # Set attributes
+    def _spawn(self, entrance, offset=0):
+        '''Adds an agent at the entrance, reusing a retired agent if possible'''
+        # Determine position, velocity and turning action
+        pos, direction, action, center = self.scenario.spawn(entrance, offset)
+        vel = tuple(scale(direction, self.vmax))
+        # Set attributes
+        if self.parked:
+            agent = self.parked.pop()
+            self.sim.setAgentPosition(agent, pos)
+            self.sim.setAgentVelocity(agent, (0, 0))
+        else:
             agent = self.sim.addAgent(pos)
-            self.sim.setAgentPrefVelocity(agent, vel)
-            self.not_acted.add(agent)
+            self._reserve(agent + 1)
             # Create body for sim
             colors = ['r', 'g', 'b', 'm', 'k']
             color = colors[agent%len(colors)]
             self.bodies.append(Circle(pos, self.r, color=color))
+        self.sim.setAgentPrefVelocity(agent, vel)
+        self.actions[agent], self.centers[agent] = action, center
+        self.not_acted[agent] = True
+        self.entry_times[agent], self.positions[agent], self.distances[agent] = self.t, pos, 0
+        self.active.add(agent)
+        self.spawned += 1
+
+    def _reserve(self, N):
+        '''Grows the per-agent arrays to hold at least N agents'''
+        n = len(self.actions)
+        if N > n:
+            extra = max(N, 2*n) - n
+            self.actions = np.concatenate((self.actions, np.zeros(extra, dtype=int)))
+            self.centers = np.concatenate((self.centers, np.zeros((extra, 2))))
+            self.not_acted = np.concatenate((self.not_acted, np.zeros(extra, dtype=bool)))
+            self.entry_times = np.concatenate((self.entry_times, np.zeros(extra)))
+            self.positions = np.concatenate((self.positions, np.zeros((extra, 2))))
+            self.distances = np.concatenate((self.distances, np.zeros(extra)))
+
+    def _retire(self, agent):
+        '''Removes an agent that has crossed, parking it far away from the roads'''
+        # Every agent should have taken its turning action before leaving
+        assert(not (self.turning and self.not_acted[agent]))
+        # Record crossing
+        if self.crossed == len(self.crossings):
+            self.crossings = np.concatenate((self.crossings, np.zeros((max(1, self.crossed), 3))))
+        self.crossings[self.crossed] = self.entry_times[agent], self.t, self.distances[agent]
+        self.crossed += 1
+        # Park agent
+        x_min, x_max, y_min, y_max = self.scenario.bounds()
+        park = (x_max + 10*self.R + 10*self.r*agent, y_max + 10*self.R)
+        self.sim.setAgentPosition(agent, park)
+        self.sim.setAgentVelocity(agent, (0, 0))
+        self.sim.setAgentPrefVelocity(agent, (0, 0))
+        self.bodies[agent].center = park
+        self.not_acted[agent] = False
+        self.active.discard(agent)
+        self.parked.append(agent)
+
+    def _control_loop(self):
+        '''Control loop for the agents'''
+        # Update agents
+        self.sim.doStep()
+        self.t += self.dt
+        # Track distance travelled
+        agents = np.array(list(self.active), dtype=int)
+        pos = np.array([self.sim.getAgentPosition(agent) for agent in agents]).reshape(-1, 2)
+        step = pos - self.positions[agents]
+        self.distances[agents] += np.hypot(step[:, 0], step[:, 1])
+        self.positions[agents] = pos
+        # Remove agents that have crossed
+        for agent in agents:
+            vel = self.sim.getAgentPrefVelocity(agent)
+            if self.scenario.exited(self.positions[agent], vel, margin=self.r):
+                self._retire(agent)
+        # Add new agents, if applicable, queued behind each other at the same entrance
+        queued = {}
+        for entrance in self.scenario.arrivals(self.dt):
+            k = queued.get(entrance[0], 0)
+            self._spawn(entrance, offset=3*self.r*k)
+            queued[entrance[0]] = k + 1
         # Check for collisions
-        N = self.sim.getNumAgents()
-        for a1, a2 in combinations(range(N), 2):
-            p1 = self.sim.getAgentPosition(a1)
-            p2 = self.sim.getAgentPosition(a2)
-            diff = norm(np.subtract(p1, p2))
-            if diff <= 2*self.r:
-                self.collisions += 1
-                # print 'COLLSION'
+        positions = self.positions[list(self.active)].tolist()
+        self.collisions += close_pairs(positions, 2*self.r)
         # Check for turning
         if self.turning:
-            directions = {'straight': 0, 'left': np.pi/2, 'right': -np.pi/2}
-            acted_agents = []
-            for agent in self.not_acted:
-                # Get agent attributes
-                pos = self.sim.getAgentPosition(agent)
-                vel0 = self.sim.getAgentPrefVelocity(agent)
-                action = self.actions[agent]
-                direction = directions[action]
-                # Determine when to steer robot
-                if action == 'straight':
-                    ready = True
-                elif action == 'left':
-                    crossed_int = abs(angle(pos, vel0)) <= np.pi/2
-                    time_to_cross = norm(pos) >= norm([self.w/4, self.w/4])
-                    ready = crossed_int and time_to_cross
-                elif action == 'right':
-                    time_to_cross = norm(pos) <= norm([self.w/4, self.w/4])
-                    ready = time_to_cross
-                # Steer robot, if applicable
-                if ready:
-                    vel = tuple(rotate(vel0, direction))
-                    self.sim.setAgentPrefVelocity(agent, vel)
-                    acted_agents.append(agent)
-            # Removed acted agents
-            self.not_acted.difference_update(acted_agents)
+            self._turn()
+
+    def _turn(self):
+        '''Steers every agent that is ready to take its turning action'''
+        agents = np.flatnonzero(self.not_acted)
+        if len(agents) == 0:
+            return
+        # Get agent attributes, relative to their turning intersections
+        pos = np.array([self.sim.getAgentPosition(agent) for agent in agents]) - self.centers[agents]
+        vel0 = np.array([self.sim.getAgentPrefVelocity(agent) for agent in agents])
+        actions = self.actions[agents]
+        # Determine when to steer robots, from the signed distance along the road past the center
+        dist = np.hypot(pos[:, 0], pos[:, 1])
+        along = np.sum(pos * vel0, axis=1) / np.hypot(vel0[:, 0], vel0[:, 1])
+        near_int = norm([self.w/4, self.w/4])
+        ready = ((actions == STRAIGHT) |
+                 ((actions == LEFT) & (along >= 0) & (dist >= near_int)) |
+                 ((actions == RIGHT) & (along >= -self.w/4)))
+        # Steer robots, if applicable
+        agents, vel0, actions = agents[ready], vel0[ready], actions[ready]
+        c, s = np.cos(DIRECTIONS[actions]), np.sin(DIRECTIONS[actions])
+        vel = np.column_stack((c*vel0[:, 0] - s*vel0[:, 1], s*vel0[:, 0] + c*vel0[:, 1]))
+        for agent, v in zip(agents, vel):
+            self.sim.setAgentPrefVelocity(agent, tuple(v))
+        # Remove acted agents
+        self.not_acted[agents] = False
 
     def _init_ani(self):
         '''Initialize the animation'''
@@ -169,9 +235,46 @@ class Simulation(object):
             self._run_ani(fname=fname)
         else:
             self._run_sim()
-        return self.average_collisions()
+        return self.metrics()
+
+    def metrics(self):
+        '''Collision, latency and throughput metrics of the simulation'''
+        return {
+            'collisions': self.average_collisions(),
+            'crossing_time': self.average_crossing_time(),
+            'speed': self.average_speed(),
+            'throughput': self.throughput(),
+        }
 
     def average_collisions(self):
-        '''The average number of observed targets'''
-        N = self.sim.getNumAgents()
+        '''The average number of collisions per agent'''
+        N = self.spawned
         return self.collisions/float(N) if N != 0 else 0
+
+    def crossing_times(self):
+        '''Time for each agent that crossed, from entering to leaving the roads (s)'''
+        entry, exit = self.crossings[:self.crossed, 0], self.crossings[:self.crossed, 1]
+        return exit - entry
+
+    def average_crossing_time(self):
+        '''The average time for agents to cross (s)'''
+        return np.mean(self.crossing_times()) if self.crossed != 0 else 0
+
+    def average_speed(self, normalize=True):
+        '''The average speed of agents while crossing, normalized by the maximum speed if requested'''
+        if self.crossed == 0:
+            return 0
+        speeds = self.crossings[:self.crossed, 2]/self.crossing_times()
+        avg = np.mean(speeds)
+        return avg/self.vmax if normalize else avg
+
+    def warmup(self):
+        '''Time for the first agents to cross the empty roads at maximum speed (s)'''
+        x_min, x_max, y_min, y_max = self.scenario.bounds()
+        return max(x_max - x_min, y_max - y_min)/self.vmax
+
+    def throughput(self, sustained=True):
+        '''The number of agents crossing per second, after the warmup if sustained'''
+        start = min(self.warmup(), self.T/2) if sustained else 0
+        exits = self.crossings[:self.crossed, 1]
+        return np.sum(exits >= start)/(self.T - start)
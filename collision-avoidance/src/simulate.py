@@ -6,19 +6,25 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 from argparse import ArgumentParser
+from os.path import splitext
 from random import seed
+from time import time
 
-from sim import Simulation
+from scenario import Scenario
+from sim import Simulation, golden
+from util import Progress, load_results
 
-def run_all(probabilities, samples=25, turning=False, fname=None):
-    average_collisions = []
+def run_all(probabilities, samples=25, turning=False, fname=None, results=None):
+    '''Runs and plots each probability, appending each finished simulation to results, if given'''
+    metrics = []
+    progress = Progress(len(probabilities) * samples, fname=results)
     # Run simulation for each ratio
     for i, probability in enumerate(probabilities):
         print 'Probability {} of {}: {}'.format(i+1, len(probabilities), probability)
         # Run each probability for the given number of samples
-        collisions = run(probability, samples=samples, turning=turning)
-        average_collisions.append(collisions)
-    # Plot
+        metrics.append(run(probability, samples=samples, turning=turning, progress=progress))
+    # Plot collisions
+    average_collisions = [m['collisions'] for m in metrics]
     plt.plot(average_collisions, probabilities)
     plt.title('Probability vs. Collisions')
     plt.xlabel('Average Collisions (per robot)')
@@ -28,25 +34,68 @@ def run_all(probabilities, samples=25, turning=False, fname=None):
     if fname:
         plt.savefig(fname)
     plt.show()
+    plot_throughput(probabilities, metrics, fname=fname)
 
-def run(probability, samples=1, turning=False, fname=None):
-    # Run simulation for each radius
-    average_collisions = []
+def plot_throughput(probabilities, metrics, fname=None):
+    '''Plots the throughput and crossing time versus the probability of robots entering'''
+    fig, ax1 = plt.subplots()
+    ax1.plot(probabilities, [m['throughput'] for m in metrics], 'b-')
+    ax1.set_xlabel('Probability of Robot Entering (%)')
+    ax1.set_ylabel('Throughput (robots/s)', color='b')
+    ax2 = ax1.twinx()
+    ax2.plot(probabilities, [m['crossing_time'] for m in metrics], 'r--')
+    ax2.set_ylabel('Average Crossing Time (s)', color='r')
+    plt.title('Throughput vs. Probability')
+    ax1.grid(True)
+    # Save, if requested
+    if fname:
+        root, ext = splitext(fname)
+        plt.savefig('{}_throughput{}'.format(root, ext))
+    plt.show()
+
+def plot_results(results, fname=None):
+    '''Plots the collisions and throughput of each probability so far, from a results file'''
+    points = load_results(results)
+    probabilities = sorted(p for p, in points)
+    metrics = [points[(p,)][0] for p in probabilities]
+    plt.plot([m['collisions'] for m in metrics], probabilities, 'o-')
+    plt.title('Probability vs. Collisions ({} samples)'.format(sum(n for _, n in points.values())))
+    plt.xlabel('Average Collisions (per robot)')
+    plt.ylabel('Probability of Robot Entering (%)')
+    plt.grid(True)
+    # Save, if requested
+    if fname:
+        plt.savefig(fname)
+    plt.show()
+    plot_throughput(probabilities, metrics, fname=fname)
+
+def run(probability, samples=1, turning=False, fname=None, progress=None):
+    '''Runs the probability for the given number of samples, averaging the metrics'''
+    metrics = []
     for i, sample in enumerate(range(samples)):
         print '\tSim {} of {}'.format(i+1, samples)
         sim = Simulation(probability, turning=turning)
-        sim.run(animate=False, fname=fname)
-        average_collisions.append(sim.average_collisions())
-    return float(sum(average_collisions)) / len(average_collisions)
+        metrics.append(sim.run(animate=False, fname=fname))
+        if progress:
+            progress.update((probability,), **metrics[-1])
+    return {key: float(sum(m[key] for m in metrics)) / len(metrics) for key in metrics[0]}
 
 def parser():
     '''Creates the argument parser'''
     parser = ArgumentParser(description='Highway Collision Avoidance')
     parser.add_argument('-s', '--seed', default=0, type=int, help='seed for random generator')
     parser.add_argument('-o', '--output_file', default=None, help='file destination of output')
-    parser.add_argument('-p', '--probability', default=0.04, type=int, help='probability of robots entering')
+    parser.add_argument('-p', '--probability', default=0.04, type=float, help='probability of robots entering')
+    parser.add_argument('-g', '--grid', default=None, type=int, nargs=2, metavar=('ROWS', 'COLS'), help='simulate a grid of intersections')
+    parser.add_argument('-d', '--spacing', default=100, type=float, help='distance between intersections of the grid')
+    parser.add_argument('-l', '--rate', default=None, type=float, help='Poisson arrival rate of each entrance (robots/s)')
+    parser.add_argument('-t', default=60, type=float, help='total time')
     parser.add_argument('-u', '--turning', action='store_true', help='enable turning at intersection')
     parser.add_argument('-i', '--animate', action='store_true', help='animate simulation')
+    parser.add_argument('--record_golden', default=None, metavar='FILE', help='record reference positions of the golden scenarios')
+    parser.add_argument('--check_golden', default=None, metavar='FILE', help='compare the simulation against recorded reference positions')
+    parser.add_argument('-f', '--results', default=None, metavar='FILE', help='write each finished simulation of run_all to a results file, replacing its contents')
+    parser.add_argument('--plot_results', default=None, metavar='FILE', help='plot the results of run_all so far')
     parser.add_argument('-a', '--run_all', action='store_true', help='run simulation for every probability')
     return parser
 
@@ -54,15 +103,34 @@ def main():
     # Read arguments
     args = parser().parse_args()
     seed(args.seed)
+    np.random.seed(args.seed)
+    # Plot results so far
+    if args.plot_results:
+        plot_results(args.plot_results, fname=args.output_file)
+    # Record or check golden positions
+    elif args.record_golden:
+        golden.record(args.record_golden)
+    elif args.check_golden:
+        divergences = golden.compare(args.check_golden)
+        print 'divergences = {}'.format(len(divergences))
     # Run once
-    if not args.run_all:
-        sim = Simulation(args.probability, turning=args.turning)
+    elif not args.run_all:
+        rows, cols = args.grid or (1, 1)
+        scenario = Scenario(rows, cols, spacing=args.spacing, prob=args.probability, rates=args.rate)
+        sim = Simulation(args.probability, T=args.t, turning=args.turning, scenario=scenario)
+        start = time()
         sim.run(animate=args.animate, fname=args.output_file)
+        elapsed = time() - start
         print 'collisions = {}'.format(sim.average_collisions())
+        print 'crossed = {} of {}'.format(sim.crossed, sim.spawned)
+        print 'crossing time = {:.3g} s'.format(sim.average_crossing_time())
+        print 'speed = {:.3g} (of vmax)'.format(sim.average_speed())
+        print 'throughput = {:.3g} robots/s'.format(sim.throughput())
+        print 'wall time = {:.3g} s ({:.3g} robots/s)'.format(elapsed, sim.spawned/elapsed)
     # Run all
     else:
         probabilities = np.linspace(0.04, 0.2, 17)
-        run_all(probabilities, turning=args.turning, fname=args.output_file)
+        run_all(probabilities, turning=args.turning, fname=args.output_file, results=args.results)
 
 if __name__ == '__main__':
     main()
@@ -1,4 +1,5 @@
 import numpy as np
+from math import floor, hypot
 from numpy.linalg import norm
 
 def sign(x):
@@ -55,3 +56,22 @@ def reflect(v1, v2):
     v2 = unit_vec(v2)
     ref = (v1 - 2 * v2 * np.dot(v1, v2)).tolist()
     return angle(v1, ref)
+
+def close_pairs(points, dist):
+    '''Number of pairs of points within the given distance of each other'''
+    # Bin points into square cells with sides of the given distance
+    cells = {}
+    for i, (x, y) in enumerate(points):
+        cells.setdefault((int(floor(x/dist)), int(floor(y/dist))), []).append((x, y))
+    # Compare each cell against itself and half of its neighbors, so each pair is counted once
+    n = 0
+    for (cx, cy), cell in cells.items():
+        for i, (x1, y1) in enumerate(cell):
+            for x2, y2 in cell[i+1:]:
+                n += hypot(x2 - x1, y2 - y1) <= dist
+        for dx, dy in ((1, -1), (1, 0), (1, 1), (0, 1)):
+            neighbor = cells.get((cx + dx, cy + dy), [])
+            for x1, y1 in cell:
+                for x2, y2 in neighbor:
+                    n += hypot(x2 - x1, y2 - y1) <= dist
+    return n
@@ -10,6 +10,31 @@ from abc import ABCMeta, abstractmethod
 def close(x, y, eps=0.001):
     return norm(np.subtract(x, y)) <= eps
 
+def reflect_out_of_bounds(agents):
+    '''Steers every agent that is out of bounds and heading away back in bounds, all at once'''
+    if len(agents) == 0:
+        return
+    x = np.array([agent._x for agent in agents])
+    env_radius = np.array([agent.env_radius for agent in agents])
+    # Find agents out of bounds, then those of them not heading back in bounds
+    out = np.flatnonzero(np.sum(x[:, 0:2]**2, axis=1) >= env_radius**2)
+    if len(out) == 0:
+        return
+    pos, orient = x[out, 0:2], np.column_stack((np.cos(x[out, 2]), np.sin(x[out, 2])))
+    away = np.sum(pos * orient, axis=1) >= 0
+    flagged = out[away]
+    if len(flagged) == 0:
+        return
+    # Reflect orientation against the inward normal
+    v, n = orient[away], -pos[away]
+    n = n / np.hypot(n[:, 0], n[:, 1])[:, np.newaxis]
+    ref = v - 2 * n * np.sum(v * n, axis=1)[:, np.newaxis]
+    # Steer by the angle between the orientation and its reflection
+    a = np.arctan2(ref[:, 1], ref[:, 0]) - np.arctan2(v[:, 1], v[:, 0])
+    a = np.where(np.abs(a) > pi, a - np.sign(a) * 2 * pi, a)
+    for i, alpha in zip(flagged, a):
+        agents[i].set_steering(alpha)
+
 class Agent(object):
     '''
     Base clase for an agent (2D point) in the simulation.
@@ -20,14 +45,17 @@ class Agent(object):
         - env_radius: radius of environment radius (m)
         - radius: radius of agent
         - color: color of agent
+
+    Agents are kept compact for large populations: their attributes are slotted, the robots and
+    targets in the environment are shared rather than copied, and drawables are made on request.
     '''
     __metaclass__ = ABCMeta
+    __slots__ = ('_x', '_u', 'env_radius', 'radius', 'color', 'state_history', 'robots', 'targets')
 
     def __init__(self, x, u, env_radius=100, radius=2, color='black'):
         self._x, self._u = list(x), list(u)
-        self.body = Circle(self.position(), radius, color=color)
         self.env_radius = env_radius
-        self.drawables = [self.body]
+        self.radius, self.color = radius, color
         self.state_history = [self._x[:]]
         self.robots, self.targets = [], []
 
@@ -67,12 +95,12 @@ class Agent(object):
         self._u[1] = alpha
 
     def set_robots(self, robots):
-        '''Sets the robots in the environment'''
-        self.robots = [robot for robot in robots if robot != self]
+        '''Sets the robots in the environment, which may include the agent itself'''
+        self.robots = robots
 
     def set_targets(self, targets):
-        '''Sets the targets in the environment'''
-        self.targets = [target for target in targets if target != self]
+        '''Sets the targets in the environment, which may include the agent itself'''
+        self.targets = targets
 
     def orientation_vec(self, mag=1):
         '''Orientation vector of the agent'''
@@ -92,10 +120,10 @@ class Agent(object):
         '''Returns if the agent is heading back in bounds'''
         return abs(angle(self.position(), self.orientation_vec())) > pi/2
 
-    def update_control(self, dt):
-        '''Updates the control'''
+    def update_control(self, dt, bounds=True):
+        '''Updates the control, unless bounds are handled by reflect_out_of_bounds'''
         # Update heading, if out of bounds
-        if self.out_of_bounds() and not self.heading_in_bounds():
+        if bounds and self.out_of_bounds() and not self.heading_in_bounds():
             neg_pos = [-p for p in self.position()]
             self.set_steering(reflect(self.orientation_vec(), neg_pos))
             # self.set_steering(-sign(self.orientation()) * pi)
@@ -111,11 +139,15 @@ class Agent(object):
         self.set_steering(0)
         self.state_history.append(self._x[:])
 
-    def draw(self, ax):
-        '''Draws the agent at each time step'''
+    def make_drawables(self):
+        '''Creates the drawables of the agent'''
+        return [Circle(self.position(), self.radius, color=self.color)]
+
+    def draw(self, ax, drawables):
+        '''Draws the agent's drawables at each time step'''
         # Draw everything
         drawn_items = []
-        for drawable in self.drawables:
+        for drawable in drawables:
             if isinstance(drawable, Circle):
                 drawable.center = self.position()
             else:
@@ -134,6 +166,8 @@ class Robot(Agent):
     Inputs: (see Agent)
         - max_speed: maximum speed (m/s)
     '''
+    __slots__ = ('max_speed', 'predictive_tracking', 'Frt_p', 'Frr_p', 'sensed_targets', 'tracked_targets', 'force')
+
     def __init__(self, env_radius=100, x=None, u=None, max_speed=2, tracking=False, color='blue'):
         self.max_speed = max_speed
         # Set x, u if needed
@@ -147,15 +181,18 @@ class Robot(Agent):
         else:
             self.Frt_p = ((0, -1), (4, 0), (8, 1), (30, 1), (30, 0))
         self.Frr_p = ((0, -1), (12.5, -1), (20, 0))
+        # Set targets
+        self.sensed_targets, self.tracked_targets = [], []
+
+    def make_drawables(self):
+        '''Creates the drawables of the robot, including its potential field's radii'''
+        drawables = super(Robot, self).make_drawables()
         do, _ = zip(*self.Frt_p)
-        dr, _ = zip(*self.Frr_p)
-        # Add drawables
         radii = do[1:] if self.predictive_tracking else do[1:-1]
         colors = ['red', 'green', 'green', 'blue']
         for c,r in zip(colors, radii):
-            self.drawables.append(Circle(self.position(), r, ec=c, fc='none', linewidth=1, alpha=0.25))
-        # Set targets
-        self.sensed_targets, self.tracked_targets = [], []
+            drawables.append(Circle(self.position(), r, ec=c, fc='none', linewidth=1, alpha=0.25))
+        return drawables
 
     def sensing_range(self):
         '''Maximum sensing range of the robot'''
@@ -219,12 +256,14 @@ class Robot(Agent):
             for target in self.sensed_targets + self.tracked_targets:
                 force = np.add(force, self.weight(target) * self.target_force(target))
             for robot in self.robots:
-                force = np.add(force, self.robot_force(robot))
+                if robot is not self:
+                    force = np.add(force, self.robot_force(robot))
         else:
             for target in self.targets:
                 force = np.add(force, self.weight(target) * self.target_force(target))
             for robot in self.robots:
-                force = np.add(force, self.robot_force(robot))
+                if robot is not self:
+                    force = np.add(force, self.robot_force(robot))
         # Normalize to have magnitude of max_speed
         return (self.max_speed * unit_vec(force)).tolist()
 
@@ -240,23 +279,24 @@ class Robot(Agent):
         f_mag = np.interp(norm(difference), *zip(*self.Frt_p))
         return f_mag * difference
 
-    def update_control(self, dt):
-        '''Updates the control'''
-        self.force = self.potential_field(dt)
-        # Update speed, depending on status
-        if self.idle():
-            self.set_speed(self.max_speed)
-        else:
-            self.set_speed(norm(self.force))
-        # Update steering angle
-        if norm(self.force) != 0:
-            self.set_steering(angle(self.orientation_vec(), self.force))
+    def update_control(self, dt, field=True, bounds=True):
+        '''Updates the control, holding the previous one if field is disabled'''
+        if field:
+            self.force = self.potential_field(dt)
+            # Update speed, depending on status
+            if self.idle():
+                self.set_speed(self.max_speed)
+            else:
+                self.set_speed(norm(self.force))
+            # Update steering angle
+            if norm(self.force) != 0:
+                self.set_steering(angle(self.orientation_vec(), self.force))
         # Update heading, if out of bounds
-        super(Robot, self).update_control(dt)
+        super(Robot, self).update_control(dt, bounds=bounds)
 
-    def draw(self, ax):
+    def draw(self, ax, drawables):
         '''Draws the robot, called every time step'''
-        drawables = super(Robot, self).draw(ax)
+        drawables = super(Robot, self).draw(ax, drawables)
         force = np.multiply(10, self.force).tolist()
         # force_arrow = Arrow(*(self.position() + force), width=1.0, color='blue', alpha=0.25)
         # drawables.append(ax.add_patch(force_arrow))
@@ -268,6 +308,8 @@ class Target(Agent):
 
     Inputs: (see Agent)
     '''
+    __slots__ = ()
+
     def __init__(self, env_radius=100, x=None, u=None, color='cyan'):
         # Set x, u if needed
         x = x or pol2cart((uniform(0, env_radius), uniform(-pi, pi))) + tuple([uniform(-pi, pi)])
@@ -297,11 +339,14 @@ class Target(Agent):
                 n += 1
         return n
 
-    def update_control(self, dt, rand=True, chance=0.05):
+    def random_steering(self, chance=0.05):
+        '''Random relative steering angle, nonzero with the given chance'''
+        return uniform(-pi/2, pi/2) if random() < chance else 0
+
+    def update_control(self, dt, rand=True, chance=0.05, bounds=True):
         '''Updates the control'''
         # Maintain speed and randomly steer
         if rand:
-            alpha = uniform(-pi/2, pi/2) if random() < chance else 0
-            self.set_steering(alpha)
+            self.set_steering(self.random_steering(chance))
         # Update heading, if out of bounds
-        super(Target, self).update_control(dt)
+        super(Target, self).update_control(dt, bounds=bounds)
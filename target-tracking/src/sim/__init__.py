@@ -1 +1,2 @@
 from sim import *
+from partitioned import *
@@ -0,0 +1,92 @@
+from random import seed as py_seed
+
+import numpy as np
+
+from sim import Simulation
+
+# Scenarios to record, as the arguments of Simulation
+SCENARIOS = {
+    'default': dict(m=3, n=6, T=120, dt=1, env_radius=100),
+    'crowded': dict(m=10, n=20, T=120, dt=1, env_radius=50),
+    'tracking': dict(m=10, n=20, T=120, dt=1, env_radius=100, tracking=True),
+    'multirate': dict(m=10, n=20, T=60, dt=0.5, env_radius=100, tracking=True, control_dt=1, target_dt=2),
+}
+SEEDS = (0, 1, 2)
+
+def _run(make_sim, scenario, seed):
+    '''Runs the scenario tick by tick, returning the robots' and targets' states and the observations'''
+    py_seed(seed)
+    np.random.seed(seed)
+    sim = make_sim(**scenario)
+    observed = []
+    try:
+        for _ in sim.ts:
+            sim._control_loop()
+            observed.append(sim.observed_targets)
+    finally:
+        if hasattr(sim, 'close'):
+            sim.close()
+    robots = np.array([robot.state_history for robot in sim.robots]).reshape(len(sim.robots), -1, 3)
+    targets = np.array([target.state_history for target in sim.targets]).reshape(len(sim.targets), -1, 3)
+    return robots, targets, np.array(observed)
+
+def record(fname, make_sim=Simulation, scenarios=SCENARIOS, seeds=SEEDS):
+    '''Records the reference trajectories and observations of every scenario and seed'''
+    golden = {}
+    for name, scenario in sorted(scenarios.items()):
+        for seed in seeds:
+            print 'Recording {} (seed {})'.format(name, seed)
+            key = '{}-{}'.format(name, seed)
+            golden[key + '__robots'], golden[key + '__targets'], golden[key + '__observed'] = _run(make_sim, scenario, seed)
+    np.savez_compressed(fname, **golden)
+
+def _pad(states, N, T):
+    '''Pads or truncates the states to N agents and T ticks, marking missing agents with NaN'''
+    padded = np.nan * np.ones((N, T) + states.shape[2:])
+    padded[:states.shape[0]] = states[:, :T]
+    return padded
+
+def _first_divergence(ref, alt, atol):
+    '''First tick and agent where the states differ by more than the tolerance, if any (tick 0 is the initial state)'''
+    # Compare the ticks of both runs, with agents missing from either as NaN
+    N, T = max(len(ref), len(alt)), min(ref.shape[1], alt.shape[1])
+    missing = ref.shape[1] != alt.shape[1]
+    ref, alt = _pad(ref, N, T), _pad(alt, N, T)
+    bad = np.any(~np.isclose(ref, alt, rtol=0, atol=atol, equal_nan=True), axis=2)
+    if not np.any(bad):
+        # Ticks missing from either run diverge from the first of them
+        return (T, None) if missing else None
+    tick = np.flatnonzero(np.any(bad, axis=0))[0]
+    return tick, np.flatnonzero(bad[:, tick])[0]
+
+def compare(fname, make_sim=Simulation, scenarios=SCENARIOS, atol=1e-9):
+    '''
+    Replays every recorded scenario with the simulation and compares it to the reference
+
+    Returns a list of (scenario-seed, quantity, tick, agent) for each divergence, where the tick
+    and agent are the first to differ by more than the tolerance, or the first tick missing from
+    either run. Tick t is after t time steps.
+    '''
+    golden = np.load(fname)
+    divergences = []
+    for key in sorted(set(k.split('__')[0] for k in golden.files)):
+        name, seed = key.rsplit('-', 1)
+        robots, targets, observed = _run(make_sim, scenarios[name], int(seed))
+        found = []
+        # Compare states
+        for quantity, ref, alt in [('robot', golden[key + '__robots'], robots), ('target', golden[key + '__targets'], targets)]:
+            divergence = _first_divergence(ref, alt, atol)
+            if divergence:
+                found.append((key, quantity) + divergence)
+        # Compare observations, counted at the end of each tick
+        ref = golden[key + '__observed']
+        T = min(len(ref), len(observed))
+        diff = np.flatnonzero(ref[:T] != observed[:T])
+        if len(diff) or len(ref) != len(observed):
+            found.append((key, 'observed', (diff[0] if len(diff) else T) + 1, None))
+        for _, quantity, tick, agent in found:
+            print '{}: {} diverged at tick {}{}'.format(key, quantity, tick, '' if agent is None else ', agent {}'.format(agent))
+        if not found:
+            print '{}: ok'.format(key)
+        divergences.extend(found)
+    return divergences
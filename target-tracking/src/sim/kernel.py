@@ -0,0 +1,304 @@
+from math import atan2, cos, sin, sqrt, hypot, pi
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Compile the kernel, if Numba is installed
+available = njit is not None
+jit = njit if available else (lambda f: f)
+
+@jit
+def _interp(x, xp, fp):
+    '''Linear interpolation, as np.interp'''
+    n = len(xp)
+    if x > xp[n-1]:
+        return fp[n-1]
+    if x < xp[0]:
+        return fp[0]
+    j = n - 1
+    while xp[j] > x:
+        j -= 1
+    if j == n - 1 or xp[j] == x:
+        return fp[j]
+    slope = (fp[j+1] - fp[j]) / (xp[j+1] - xp[j])
+    return slope * (x - xp[j]) + fp[j]
+
+@jit
+def _distance(x1, y1, x2, y2):
+    '''Euclidean distance from the first point to the second'''
+    dx, dy = x2 - x1, y2 - y1
+    return sqrt(dx * dx + dy * dy)
+
+@jit
+def _angle(x1, y1, x2, y2):
+    '''Angle between two vectors, as util.angle'''
+    a = atan2(y2, x2) - atan2(y1, x1)
+    if not (-pi <= a <= pi):
+        a -= (-1 if a <= 0 else 1) * 2 * pi
+    return a
+
+@jit
+def _num_sensing(rx, srange, x, y):
+    '''The number of robots sensing the position'''
+    k = 0
+    for q in range(rx.shape[0]):
+        if _distance(rx[q, 0], rx[q, 1], x, y) <= srange:
+            k += 1
+    return k
+
+@jit
+def _most_sensed(rx, tx, srange):
+    '''Largest number of targets sensed by any robot'''
+    most = 0
+    for i in range(rx.shape[0]):
+        k = 0
+        for j in range(tx.shape[0]):
+            if _distance(rx[i, 0], rx[i, 1], tx[j, 0], tx[j, 1]) <= srange:
+                k += 1
+        most = max(most, k)
+    return most
+
+@jit
+def _target_force(rx, i, x, y, srange, weigh, frt_x, frt_y):
+    '''Weighted force vector of the robot towards the position'''
+    dx, dy = x - rx[i, 0], y - rx[i, 1]
+    d = sqrt(dx * dx + dy * dy)
+    w = 0.25
+    if d <= srange and (not weigh or _num_sensing(rx, srange, x, y) <= 1):
+        w = 1.0
+    f_mag = _interp(d, frt_x, frt_y)
+    return w * (f_mag * dx), w * (f_mag * dy)
+
+@jit
+def _remove(ids, k, count):
+    '''Removes the kth of the first count rows, shifting the rest down'''
+    for q in range(k, count - 1):
+        ids[q] = ids[q+1]
+
+@jit
+def _potential_field(i, rx, tx, tu, max_speed, frt_x, frt_y, frr_x, frr_y, tracking,
+                     sensed, nsensed, tracked, ntracked, dt):
+    '''Potential field of the robot, as Robot.potential_field'''
+    srange, trange = frt_x[3], frt_x[4]
+    fx, fy = 0.0, 0.0
+    if tracking:
+        # Update sensed targets, iterating while removing as the robot does
+        k = 0
+        while k < nsensed[i]:
+            j = sensed[i, k]
+            d = _distance(rx[i, 0], rx[i, 1], tx[j, 0], tx[j, 1])
+            if not d <= srange:
+                _remove(sensed[i], k, nsensed[i])
+                nsensed[i] -= 1
+            if srange <= d <= trange:
+                c = ntracked[i]
+                tracked[i, c, 0:3] = tx[j]
+                tracked[i, c, 3:5] = tu[j]
+                ntracked[i] += 1
+            k += 1
+        # Update tracked targets
+        k = 0
+        while k < ntracked[i]:
+            t = tracked[i, k]
+            t[0] += t[3] * cos(t[2]) * dt
+            t[1] += t[3] * sin(t[2]) * dt
+            t[2] += t[4]
+            t[4] = 0
+            d = _distance(rx[i, 0], rx[i, 1], t[0], t[1])
+            if not (srange <= d <= trange):
+                _remove(tracked[i], k, ntracked[i])
+                ntracked[i] -= 1
+            k += 1
+        # Add new sensed targets
+        for j in range(tx.shape[0]):
+            if _distance(rx[i, 0], rx[i, 1], tx[j, 0], tx[j, 1]) <= srange:
+                new = True
+                for k in range(nsensed[i]):
+                    if sensed[i, k] == j:
+                        new = False
+                if new:
+                    sensed[i, nsensed[i]] = j
+                    nsensed[i] += 1
+        for k in range(nsensed[i]):
+            j = sensed[i, k]
+            gx, gy = _target_force(rx, i, tx[j, 0], tx[j, 1], srange, True, frt_x, frt_y)
+            fx, fy = fx + gx, fy + gy
+        for k in range(ntracked[i]):
+            gx, gy = _target_force(rx, i, tracked[i, k, 0], tracked[i, k, 1], srange, False, frt_x, frt_y)
+            fx, fy = fx + gx, fy + gy
+    else:
+        for j in range(tx.shape[0]):
+            gx, gy = _target_force(rx, i, tx[j, 0], tx[j, 1], srange, True, frt_x, frt_y)
+            fx, fy = fx + gx, fy + gy
+    for q in range(rx.shape[0]):
+        if q != i:
+            dx, dy = rx[q, 0] - rx[i, 0], rx[q, 1] - rx[i, 1]
+            f_mag = _interp(sqrt(dx * dx + dy * dy), frr_x, frr_y)
+            fx, fy = fx + f_mag * dx, fy + f_mag * dy
+    # Normalize to have magnitude of max_speed
+    f = sqrt(fx * fx + fy * fy)
+    if f != 0:
+        fx, fy = fx / f, fy / f
+    return max_speed * fx, max_speed * fy
+
+@jit
+def _reflect(x, u, R):
+    '''Steers the agent back in bounds, as reflect_out_of_bounds'''
+    ox, oy = np.cos(x[2]), np.sin(x[2])
+    if x[0]**2 + x[1]**2 >= R**2 and x[0] * ox + x[1] * oy >= 0:
+        r = hypot(x[0], x[1])
+        nx, ny = -x[0] / r, -x[1] / r
+        dot = ox * nx + oy * ny
+        a = atan2(oy - 2 * ny * dot, ox - 2 * nx * dot) - atan2(oy, ox)
+        if abs(a) > pi:
+            a -= np.sign(a) * 2 * pi
+        u[1] = a
+
+@jit
+def _update_state(x, u, dt):
+    '''Updates the state, as Agent.update_state'''
+    x[0] += u[0] * cos(x[2]) * dt
+    x[1] += u[0] * sin(x[2]) * dt
+    x[2] += u[1]
+    u[1] = 0
+
+@jit
+def _step(rx, ru, force, max_speed, tx, tu, steering, R, frt_x, frt_y, frr_x, frr_y, tracking,
+          sensed, nsensed, tracked, ntracked, update_field, control_dt, dt):
+    '''One time step of Simulation._control_loop, returning the number of observed targets'''
+    m, n = rx.shape[0], tx.shape[0]
+    srange = frt_x[3]
+    # Update control
+    if update_field:
+        for i in range(m):
+            fx, fy = _potential_field(i, rx, tx, tu, max_speed[i], frt_x, frt_y, frr_x, frr_y, tracking,
+                                      sensed, nsensed, tracked, ntracked, control_dt)
+            force[i, 0], force[i, 1] = fx, fy
+            idle = True
+            for j in range(n):
+                if _distance(rx[i, 0], rx[i, 1], tx[j, 0], tx[j, 1]) <= srange:
+                    idle = False
+            f = sqrt(fx * fx + fy * fy)
+            ru[i, 0] = max_speed[i] if idle else f
+            if f != 0:
+                ru[i, 1] = _angle(np.cos(rx[i, 2]), np.sin(rx[i, 2]), fx, fy)
+    for j in range(n):
+        tu[j, 1] = steering[j]
+    for i in range(m):
+        _reflect(rx[i], ru[i], R)
+    for j in range(n):
+        _reflect(tx[j], tu[j], R)
+    # Calculate A
+    observed = 0
+    for j in range(n):
+        if _num_sensing(rx, srange, tx[j, 0], tx[j, 1]) > 0:
+            observed += 1
+    # Update state
+    for i in range(m):
+        _update_state(rx[i], ru[i], dt)
+    for j in range(n):
+        _update_state(tx[j], tu[j], dt)
+    return observed
+
+class Kernel(object):
+    '''
+    Flat arrays of the agents' states, stepped by a kernel compiled with Numba
+
+    Inputs:
+        - robots: robots to cooperatively track targets
+        - targets: targets to be tracked
+    '''
+    def __init__(self, robots, targets):
+        m, n = len(robots), len(targets)
+        self.rx = np.array([robot._x for robot in robots], dtype=float).reshape(m, 3)
+        self.ru = np.array([robot._u for robot in robots], dtype=float).reshape(m, 2)
+        self.force = np.array([getattr(robot, 'force', (0, 0)) for robot in robots], dtype=float).reshape(m, 2)
+        self.max_speed = np.array([robot.max_speed for robot in robots], dtype=float)
+        self.tx = np.array([target._x for target in targets], dtype=float).reshape(n, 3)
+        self.tu = np.array([target._u for target in targets], dtype=float).reshape(n, 2)
+        self.env_radius = float((robots + targets)[0].env_radius) if m + n else 0.
+        # Potential fields, shared by all robots
+        robot = robots[0] if robots else None
+        self.tracking = bool(robot and robot.predictive_tracking)
+        self.frt_x, self.frt_y = (np.array(p, dtype=float) for p in zip(*robot.Frt_p)) if robot else (np.zeros(5),)*2
+        self.frr_x, self.frr_y = (np.array(p, dtype=float) for p in zip(*robot.Frr_p)) if robot else (np.zeros(3),)*2
+        # Sensed targets by index, and tracked targets' states and controls
+        index = dict((id(target), j) for j, target in enumerate(targets))
+        self.sensed = np.zeros((m, 0), dtype=int)
+        self.nsensed = np.zeros(m, dtype=int)
+        self.tracked = np.zeros((m, 0, 5))
+        self.ntracked = np.zeros(m, dtype=int)
+        for i, robot in enumerate(robots):
+            self.nsensed[i], self.ntracked[i] = len(robot.sensed_targets), len(robot.tracked_targets)
+            self._reserve(max(self.nsensed[i], self.ntracked[i]))
+            self.sensed[i, :self.nsensed[i]] = [index[id(target)] for target in robot.sensed_targets]
+            for k, target in enumerate(robot.tracked_targets):
+                self.tracked[i, k] = target._x + target._u
+
+    def _reserve(self, N):
+        '''Grows the sensed and tracked targets to hold at least N per robot'''
+        n = self.tracked.shape[1]
+        if N > n:
+            extra = max(N, 2*n) - n
+            self.sensed = np.concatenate((self.sensed, np.zeros((len(self.sensed), extra), dtype=int)), axis=1)
+            self.tracked = np.concatenate((self.tracked, np.zeros((len(self.tracked), extra, 5))), axis=1)
+
+    def step(self, steering, dt, control_dt=None, update_field=True):
+        '''Steps the agents, returning the number of observed targets'''
+        # Robots keep at most their sensed targets and add those in range, and each sensed target
+        # can add at most one tracked target
+        if self.tracking and update_field and len(self.ntracked):
+            sensed = np.max(self.nsensed) + _most_sensed(self.rx, self.tx, self.frt_x[3])
+            self._reserve(max(sensed, np.max(self.ntracked + self.nsensed)))
+        return _step(self.rx, self.ru, self.force, self.max_speed, self.tx, self.tu,
+                     np.asarray(steering, dtype=float), self.env_radius,
+                     self.frt_x, self.frt_y, self.frr_x, self.frr_y, self.tracking,
+                     self.sensed, self.nsensed, self.tracked, self.ntracked,
+                     update_field, control_dt or dt, dt)
+
+    def sync(self, robots, targets):
+        '''Updates the agents' states, controls and history from the arrays'''
+        for robot, x, u, f in zip(robots, self.rx.tolist(), self.ru.tolist(), self.force.tolist()):
+            robot._x, robot._u, robot.force = x, u, f
+            robot.state_history.append(x[:])
+        for target, x, u in zip(targets, self.tx.tolist(), self.tu.tolist()):
+            target._x, target._u = x, u
+            target.state_history.append(x[:])
+
+def check(sim, steps=None):
+    '''
+    Largest deviation of the kernel from the agents' own control and dynamics
+
+    Each time step, the kernel and the simulation's agents are stepped from the same state and
+    their states, controls and observations are compared. The simulation is stepped in place, and
+    must step its own agents rather than a kernel.
+    '''
+    assert sim.kernel is None, 'check needs a simulation with the python engine'
+    from random import getstate, setstate
+    deviation = 0
+    for step in range(steps or len(sim.ts)):
+        # Step the kernel, with the steering the targets are about to draw
+        kernel = Kernel(sim.robots, sim.targets)
+        state = getstate()
+        update_steering = sim.step % sim.target_steps == 0
+        steering = [target.random_steering() if update_steering else 0 for target in sim.targets]
+        setstate(state)
+        update_field = sim.step % sim.control_steps == 0
+        observed = kernel.step(steering, sim.dt, sim.control_steps * sim.dt, update_field)
+        # Step the agents
+        observed_targets = sim.observed_targets
+        sim._control_loop()
+        # Compare
+        deviation = max(deviation, abs(sim.observed_targets - observed_targets - observed))
+        for i, robot in enumerate(sim.robots):
+            deviation = max(deviation, np.max(np.abs(np.subtract(robot._x, kernel.rx[i]))),
+                            np.max(np.abs(np.subtract(robot._u, kernel.ru[i]))))
+            deviation = max(deviation, abs(len(robot.tracked_targets) - kernel.ntracked[i]),
+                            abs(len(robot.sensed_targets) - kernel.nsensed[i]))
+        for j, target in enumerate(sim.targets):
+            deviation = max(deviation, np.max(np.abs(np.subtract(target._x, kernel.tx[j]))))
+    return deviation
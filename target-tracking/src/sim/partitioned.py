@@ -0,0 +1,193 @@
+from multiprocessing import Process, Pipe
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+from agents import Target, reflect_out_of_bounds
+from sim import Simulation
+
+def _shared(*shape):
+    '''Array of zeros in shared memory'''
+    return np.frombuffer(RawArray('d', int(np.prod(shape))), dtype=float).reshape(shape)
+
+def _factor(k):
+    '''Splits k into the most square grid of rows and columns'''
+    rows = max(i for i in range(1, int(np.sqrt(k)) + 1) if k % i == 0)
+    return rows, k // rows
+
+class PartitionedSimulation(Simulation):
+    '''
+    Simulation of robots tracking targets, split into spatial tiles run by worker processes
+
+    Each worker owns the agents within its tile and sees the halo of agents close enough to
+    interact with them. Agent states are shared through double-buffered shared memory, and
+    agents migrate between tiles as they move. The observations match those of Simulation.
+
+    Inputs: (see Simulation)
+        - workers: number of worker processes, one per tile
+    '''
+    def __init__(self, m, n, T, dt, env_radius, tracking=False, control_dt=None, target_dt=None, workers=4):
+        super(PartitionedSimulation, self).__init__(m, n, T, dt, env_radius, tracking=tracking,
+                                                    control_dt=control_dt, target_dt=target_dt)
+        self.workers = int(workers)
+        self.rows, self.cols = _factor(self.workers)
+        self.env_radius = float(env_radius)
+        # Agents interact through targets sensed by others, so see twice the range
+        self.halo = self.robots[0].tracking_range() + self.robots[0].sensing_range() if self.robots else 0
+        # Create shared states, in two buffers, as well as controls, forces and steering
+        self.robot_x = _shared(2, m, 3)
+        self.target_x = _shared(2, n, 3)
+        self.robot_u, self.target_u = _shared(m, 2), _shared(n, 2)
+        self.force, self.steering = _shared(m, 2), _shared(n)
+        for i, robot in enumerate(self.robots):
+            self.robot_x[0, i], self.robot_u[i], robot.force = robot._x, robot._u, [0, 0]
+        for j, target in enumerate(self.targets):
+            self.target_x[0, j], self.target_u[j] = target._x, target._u
+        self.processes, self.conns = [], []
+        self.migrants = [{} for _ in range(self.workers)]
+
+    def _link_agents(self):
+        '''Agents are linked to their neighbors by the workers, each time step'''
+        pass
+
+    def tiles(self, pos):
+        '''Tile owning each position'''
+        size = 2 * self.env_radius
+        col = np.clip(np.floor((pos[:, 0] + self.env_radius) / size * self.cols), 0, self.cols - 1)
+        row = np.clip(np.floor((pos[:, 1] + self.env_radius) / size * self.rows), 0, self.rows - 1)
+        return (row * self.cols + col).astype(int)
+
+    def near(self, tile, pos):
+        '''Returns if each position is within the halo of the tile'''
+        row, col = divmod(tile, self.cols)
+        w, h = 2 * self.env_radius / self.cols, 2 * self.env_radius / self.rows
+        x_lo = -self.env_radius + col * w if col > 0 else -np.inf
+        x_hi = -self.env_radius + (col + 1) * w if col < self.cols - 1 else np.inf
+        y_lo = -self.env_radius + row * h if row > 0 else -np.inf
+        y_hi = -self.env_radius + (row + 1) * h if row < self.rows - 1 else np.inf
+        dx = np.maximum(np.maximum(x_lo - pos[:, 0], pos[:, 0] - x_hi), 0)
+        dy = np.maximum(np.maximum(y_lo - pos[:, 1], pos[:, 1] - y_hi), 0)
+        return dx**2 + dy**2 <= self.halo**2
+
+    def _start(self):
+        '''Starts a worker process for each tile'''
+        for tile in range(self.workers):
+            conn, worker_conn = Pipe()
+            process = Process(target=_work, args=(self, tile, worker_conn))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+            self.conns.append(conn)
+
+    def close(self):
+        '''Stops the worker processes, terminating any that cannot be told to'''
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except (IOError, EOFError):
+                pass
+        for process in self.processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.processes, self.conns = [], []
+
+    def _control_loop(self):
+        '''Control loop for the agents, run by the workers'''
+        if not self.processes:
+            self._start()
+        # Draw targets' random steering, in the same order as Simulation
+        if self.step % self.target_steps == 0:
+            for j, target in enumerate(self.targets):
+                self.steering[j] = target.random_steering()
+        else:
+            self.steering[:] = 0
+        # Step each tile, handing over migrating robots
+        for conn, incoming in zip(self.conns, self.migrants):
+            conn.send((self.step, incoming))
+        self.migrants = [{} for _ in range(self.workers)]
+        for conn in self.conns:
+            observed, outgoing = conn.recv()
+            self.observed_targets += observed
+            for i, (tile, state) in outgoing.items():
+                self.migrants[tile][i] = state
+        # Update agents from the new buffer
+        self.step += 1
+        buf = self.step % 2
+        for i, robot in enumerate(self.robots):
+            robot._x, robot._u, robot.force = self.robot_x[buf, i].tolist(), self.robot_u[i].tolist(), self.force[i].tolist()
+            robot.state_history.append(robot._x[:])
+        for j, target in enumerate(self.targets):
+            target._x, target._u = self.target_x[buf, j].tolist(), self.target_u[j].tolist()
+            target.state_history.append(target._x[:])
+
+    def run(self, vis='animate', fname=None):
+        '''Run the simulation with the requested visualization, then stop the workers'''
+        try:
+            return super(PartitionedSimulation, self).run(vis=vis, fname=fname)
+        finally:
+            self.close()
+
+def _work(sim, tile, conn):
+    '''Worker loop, stepping the agents within the tile until told to stop'''
+    robots, targets = sim.robots, sim.targets
+    index = dict((id(target), j) for j, target in enumerate(targets))
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        step, incoming = msg
+        cur, nxt = step % 2, (step + 1) % 2
+        robot_x, target_x = sim.robot_x[cur], sim.target_x[cur]
+        # Take over migrating robots
+        for i, (sensed, tracked) in incoming.items():
+            robots[i].sensed_targets = [targets[j] for j in sensed]
+            robots[i].tracked_targets = [Target(env_radius=sim.env_radius, x=x, u=u) for x, u in tracked]
+        # Find owned agents and their neighbors
+        own_r = np.flatnonzero(sim.tiles(robot_x[:, 0:2]) == tile)
+        own_t = np.flatnonzero(sim.tiles(target_x[:, 0:2]) == tile)
+        near_r = np.flatnonzero(sim.near(tile, robot_x[:, 0:2]))
+        near_t = np.flatnonzero(sim.near(tile, target_x[:, 0:2]))
+        for i in near_r:
+            robots[i]._x = robot_x[i].tolist()
+        for j in near_t:
+            targets[j]._x = target_x[j].tolist()
+        for i in own_r:
+            robots[i]._u, robots[i].force = sim.robot_u[i].tolist(), sim.force[i].tolist()
+        for j in own_t:
+            targets[j]._u = sim.target_u[j].tolist()
+        neighbors_r = [robots[i] for i in near_r]
+        neighbors_t = [targets[j] for j in near_t]
+        owned = [robots[i] for i in own_r] + [targets[j] for j in own_t]
+        for agent in owned + neighbors_t:
+            agent.set_robots(neighbors_r)
+            agent.set_targets(neighbors_t)
+        # Update control
+        update_field = step % sim.control_steps == 0
+        for i in own_r:
+            robots[i].update_control(sim.control_steps * sim.dt, field=update_field, bounds=False)
+        for j in own_t:
+            targets[j].set_steering(sim.steering[j])
+            targets[j].update_control(sim.target_steps * sim.dt, rand=False, bounds=False)
+        reflect_out_of_bounds(owned)
+        # Calculate A
+        observed = sum(1 for j in own_t if targets[j].sensed())
+        # Update state into the next buffer
+        for agent in owned:
+            agent.update_state(sim.dt)
+        for i in own_r:
+            sim.robot_x[nxt, i], sim.robot_u[i], sim.force[i] = robots[i]._x, robots[i]._u, robots[i].force
+        for j in own_t:
+            sim.target_x[nxt, j], sim.target_u[j] = targets[j]._x, targets[j]._u
+        # Hand over robots leaving the tile
+        outgoing = {}
+        if len(own_r):
+            dest = sim.tiles(sim.robot_x[nxt, own_r, 0:2])
+            for i, d in zip(own_r, dest):
+                if d != tile:
+                    robot = robots[i]
+                    sensed = [index[id(target)] for target in robot.sensed_targets]
+                    tracked = [(target._x, target._u) for target in robot.tracked_targets]
+                    outgoing[i] = (d, (sensed, tracked))
+        conn.send((observed, outgoing))
@@ -4,7 +4,8 @@ from matplotlib.patches import Circle
 import numpy as np
 import matplotlib.pyplot as plt
 
-from agents import Robot, Target
+from agents import Robot, Target, reflect_out_of_bounds
+from kernel import Kernel, available
 
 class Simulation(object):
     '''
@@ -14,19 +15,37 @@ class Simulation(object):
         - robots: robots to cooperatively track targets
         - targets: targets to be tracked
         - env_radius: environment radius (m)
+        - control_dt: time step of the robots' potential field control (s), defaults to dt
+        - target_dt: time step of the targets' random steering (s), defaults to dt
+        - engine: 'python' to step the agents themselves, or 'jit' to step flat arrays with a compiled kernel
     '''
-    def __init__(self, m, n, T, dt, env_radius, tracking=False):
+    def __init__(self, m, n, T, dt, env_radius, tracking=False, control_dt=None, target_dt=None, engine='python'):
         # Create agents
         self.robots = [Robot(env_radius, tracking=tracking) for _ in range(m)]
         self.targets = [Target(env_radius) for _ in range(n)]
-        for agent in self.robots + self.targets:
-            agent.set_robots(self.robots)
-            agent.set_targets(self.targets)
+        self._link_agents()
         # Create environment
         self.T, self.dt = float(T), float(dt)
         self.ts = np.arange(0, self.T, self.dt)
+        # Set control rates, as a multiple of the time step
+        self.control_steps = max(1, int(round((control_dt or self.dt)/self.dt)))
+        self.target_steps = max(1, int(round((target_dt or self.dt)/self.dt)))
+        self.step = 0
         self.env = Circle((0, 0), env_radius, color='black', linewidth=3, alpha=0.25)
         self.observed_targets = 0
+        # Use compiled kernel, if requested and available
+        self.kernel = None
+        if engine == 'jit':
+            if available:
+                self.kernel = Kernel(self.robots, self.targets)
+            else:
+                print 'WARNING: numba not installed, using python engine'
+
+    def _link_agents(self):
+        '''Lets every agent know of the others'''
+        for agent in self.robots + self.targets:
+            agent.set_robots(self.robots)
+            agent.set_targets(self.targets)
 
     def _init_ani_fig(self):
         '''Initialize the animation's figure'''
@@ -38,16 +57,26 @@ class Simulation(object):
         self.ax.set_ylim(-r, r)
         self.ax.set_aspect(1)
         self.ax.add_patch(self.env)
+        # Create agents' drawables
+        self.drawables = [agent.make_drawables() for agent in self.robots + self.targets]
         # Set time label
         self.time_label = self.ax.text(0.02, 0.95, '', transform=self.ax.transAxes)
         plt.title('Potential Field Control')
 
     def _control_loop(self):
         '''Control loop for the agents'''
-        # Update control
+        if self.kernel:
+            return self._kernel_loop()
+        # Update control at each agent's rate, holding it in between
         agents = self.robots + self.targets
-        for agent in agents:
-            agent.update_control(self.dt)
+        update_field = self.step % self.control_steps == 0
+        update_steering = self.step % self.target_steps == 0
+        for robot in self.robots:
+            robot.update_control(self.control_steps * self.dt, field=update_field, bounds=False)
+        for target in self.targets:
+            target.update_control(self.target_steps * self.dt, rand=update_steering, bounds=False)
+        # Update heading of agents out of bounds
+        reflect_out_of_bounds(agents)
         # Calculate A
         for target in self.targets:
             if target.sensed():
@@ -55,6 +84,18 @@ class Simulation(object):
         # Update state
         for agent in agents:
             agent.update_state(self.dt)
+        self.step += 1
+
+    def _kernel_loop(self):
+        '''Control loop for the agents, stepped by the compiled kernel'''
+        # Draw targets' random steering, in the same order as the agents
+        update_steering = self.step % self.target_steps == 0
+        steering = [target.random_steering() if update_steering else 0 for target in self.targets]
+        # Step kernel and update agents
+        update_field = self.step % self.control_steps == 0
+        self.observed_targets += self.kernel.step(steering, self.dt, self.control_steps * self.dt, update_field)
+        self.kernel.sync(self.robots, self.targets)
+        self.step += 1
 
     def _init_ani(self):
         '''Initialize the animation'''
@@ -69,8 +110,8 @@ class Simulation(object):
         self._control_loop()
         # Update plot
         drawables = []
-        for agent in self.robots + self.targets:
-            drawables.extend(agent.draw(self.ax))
+        for agent, agent_drawables in zip(self.robots + self.targets, self.drawables):
+            drawables.extend(agent.draw(self.ax, agent_drawables))
         # Update time label
         self.time_label.set_text('t = {:.3g} s'.format(t))
         return (self.time_label, ) + tuple(drawables)
@@ -105,7 +146,7 @@ class Simulation(object):
 
     def average_observations(self, normalize=True):
         '''The average number of observed targets'''
-        avg = self.observed_targets/self.T
+        avg = self.observed_targets/float(len(self.ts))
         if normalize and len(self.targets) != 0:
             return avg/len(self.targets)
         return avg
@@ -11,12 +11,14 @@ from agents import Robot, Target
 from math import ceil
 from random import seed
 
-from sim import Simulation
+from sim import Simulation, PartitionedSimulation, golden
+from util import Progress, load_results
 
-def run_ratios(ratios, tracking=False, samples=5, fname=None):
-    '''Runs and plots each target-robot ratio'''
+def run_ratios(ratios, tracking=False, samples=5, fname=None, engine='python', results=None):
+    '''Runs and plots each target-robot ratio, appending each finished simulation to results, if given'''
     radii = np.linspace(100, 500, 9)
     radii_plt = np.linspace(100, 500, 401)
+    progress = Progress(len(ratios) * samples * len(radii), fname=results)
     # Run simulation for each ratio
     for i, ratio in enumerate(ratios):
         print 'Ratio {} of {}: {}'.format(i+1, len(ratios), ratio)
@@ -24,7 +26,7 @@ def run_ratios(ratios, tracking=False, samples=5, fname=None):
         r, o = np.zeros(len(radii)), np.zeros(len(radii))
         for j in range(samples):
             print '\tSample {} of {}'.format(j+1, samples)
-            rn, on = run_ratio(ratio, radii, tracking)
+            rn, on = run_ratio(ratio, radii, tracking, engine=engine, progress=progress)
             r, o = np.add(r, rn), np.add(o, on)
         # Fit polynomial to average
         r, o = r/float(samples), o/float(samples)
@@ -42,7 +44,25 @@ def run_ratios(ratios, tracking=False, samples=5, fname=None):
         plt.savefig(fname)
     plt.show()
 
-def run_ratio(ratio, radii, tracking, coverage=0.1, T=120, dt=1, fname=None):
+def plot_results(results, fname=None):
+    '''Plots the observations of each target-robot ratio so far, from a results file'''
+    points = load_results(results)
+    for ratio in sorted(set(ratio for ratio, _ in points)):
+        radii = sorted(R for r, R in points if r == ratio)
+        o = [points[(ratio, R)][0]['observations'] for R in radii]
+        plt.plot(radii, o, 'o-', label='{}'.format(ratio))
+    # Create plot
+    plt.title('Observations vs. Radius ({} samples)'.format(sum(n for _, n in points.values())))
+    plt.xlabel('Environment Radius (m)')
+    plt.ylabel('Average Targets Observed (%)')
+    plt.legend(title='Ratio')
+    plt.grid(True)
+    # Save, if requested
+    if fname:
+        plt.savefig(fname)
+    plt.show()
+
+def run_ratio(ratio, radii, tracking, coverage=0.1, T=120, dt=1, fname=None, engine='python', progress=None):
     '''Runs the specified target-robot ratio for the specified environment radii'''
     # Run simulation for each radius
     observations = []
@@ -55,9 +75,11 @@ def run_ratio(ratio, radii, tracking, coverage=0.1, T=120, dt=1, fname=None):
             n = n_max
             m = int(n_max/ratio)
         print '\tSim {} of {}: n = {}, m = {}'.format(i+1, len(radii), n, m)
-        sim = Simulation(m, n, T, dt, R, tracking=tracking)
+        sim = Simulation(m, n, T, dt, R, tracking=tracking, engine=engine)
         sim.run(vis='', fname=fname)
         observations.append(sim.average_observations(normalize=True))
+        if progress:
+            progress.update((ratio, R), observations=observations[-1])
     return radii, observations
 
 def parser():
@@ -69,9 +91,17 @@ def parser():
     parser.add_argument('-n', default=6, type=int, help='# targets')
     parser.add_argument('-t', default=120, type=int, help='total time')
     parser.add_argument('-dt', default=1, type=float, help='time step')
+    parser.add_argument('-cdt', default=None, type=float, help='robot control time step (defaults to dt)')
+    parser.add_argument('-tdt', default=None, type=float, help='target steering time step (defaults to dt)')
     parser.add_argument('-r', default=100, type=int, help='environment radius')
+    parser.add_argument('-w', '--workers', default=1, type=int, help='# worker processes, splitting the environment into tiles')
+    parser.add_argument('-j', '--jit', action='store_true', help='step the simulation with a kernel compiled by numba')
     parser.add_argument('-k', '--tracking', action='store_true', help='enable predictive tracking')
     parser.add_argument('-v', '--visualization', choices=['animate', 'plot', 'both'], default='animate', help='visualize simulation')
+    parser.add_argument('--record_golden', default=None, metavar='FILE', help='record reference trajectories of the golden scenarios')
+    parser.add_argument('--check_golden', default=None, metavar='FILE', help='compare the selected engine against recorded reference trajectories')
+    parser.add_argument('-f', '--results', default=None, metavar='FILE', help='write each finished simulation of run_all to a results file, replacing its contents')
+    parser.add_argument('--plot_results', default=None, metavar='FILE', help='plot the results of run_all so far')
     parser.add_argument('-a', '--run_all', action='store_true', help='run simulation for every ratio')
     return parser
 
@@ -79,15 +109,34 @@ def main():
     # Read arguments
     args = parser().parse_args()
     seed(args.seed)
+    engine = 'jit' if args.jit else 'python'
+    # Plot results so far
+    if args.plot_results:
+        plot_results(args.plot_results, fname=args.output_file)
+    # Record or check golden trajectories
+    elif args.record_golden:
+        golden.record(args.record_golden)
+    elif args.check_golden:
+        if args.workers > 1:
+            make_sim = lambda **kwargs: PartitionedSimulation(workers=args.workers, **kwargs)
+        else:
+            make_sim = lambda **kwargs: Simulation(engine=engine, **kwargs)
+        divergences = golden.compare(args.check_golden, make_sim)
+        print 'divergences = {}'.format(len(divergences))
     # Run once
-    if not args.run_all:
-        sim = Simulation(args.m, args.n, args.t, args.dt, args.r, tracking=args.tracking)
+    elif not args.run_all:
+        if args.workers > 1:
+            sim = PartitionedSimulation(args.m, args.n, args.t, args.dt, args.r, tracking=args.tracking,
+                                        control_dt=args.cdt, target_dt=args.tdt, workers=args.workers)
+        else:
+            sim = Simulation(args.m, args.n, args.t, args.dt, args.r, tracking=args.tracking,
+                             control_dt=args.cdt, target_dt=args.tdt, engine=engine)
         sim.run(vis=args.visualization, fname=args.output_file)
         print 'observations = {}'.format(sim.average_observations(normalize=True))
     # Run ratios
     else:
         ratios = [1/5., 1/2., 1, 4, 10]
-        run_ratios(ratios, tracking=args.tracking, fname=args.output_file)
+        run_ratios(ratios, tracking=args.tracking, fname=args.output_file, engine=engine, results=args.results)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,71 @@
+from datetime import timedelta
+from time import time
+
+import json
+
+class Progress(object):
+    '''
+    Progress of a sweep of simulations, streaming finished results to a file
+
+    Inputs:
+        - total: total number of simulations in the sweep
+        - fname: file to write each finished simulation to, as a line of JSON, if any, replacing
+          the results of previous sweeps
+    '''
+    def __init__(self, total, fname=None):
+        self.total, self.done = total, 0
+        self.fname = fname
+        # Start the results afresh, so sweeps with other settings are not mixed in
+        if self.fname:
+            open(self.fname, 'w').close()
+        self.start = time()
+        self.sums, self.counts = {}, {}
+
+    def rate(self):
+        '''Finished simulations per second'''
+        elapsed = time() - self.start
+        return self.done/elapsed if elapsed > 0 else 0
+
+    def eta(self):
+        '''Estimated time remaining (s)'''
+        rate = self.rate()
+        return (self.total - self.done)/rate if rate > 0 else float('inf')
+
+    def means(self, point):
+        '''Running means of the values of the point'''
+        n = self.counts[point]
+        return dict((key, total/float(n)) for key, total in self.sums[point].items())
+
+    def update(self, point, **values):
+        '''Records a finished simulation of the point, given as a tuple, and prints the progress'''
+        self.done += 1
+        values = dict((key, float(value)) for key, value in values.items())
+        # Update running means
+        sums = self.sums.setdefault(point, dict((key, 0) for key in values))
+        for key, value in values.items():
+            sums[key] += value
+        self.counts[point] = self.counts.get(point, 0) + 1
+        means = self.means(point)
+        # Print progress
+        eta = self.eta()
+        eta_txt = str(timedelta(seconds=int(eta))) if eta != float('inf') else '?'
+        means_txt = ', '.join('{} = {:.3g}'.format(key, mean) for key, mean in sorted(means.items()))
+        print '\t[{}/{}] {:.3g} sims/s, ETA {}: {}'.format(self.done, self.total, self.rate(), eta_txt, means_txt)
+        # Append result, if requested
+        if self.fname:
+            result = {'point': list(point), 'samples': self.counts[point], 'values': values, 'means': means}
+            with open(self.fname, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+
+def load_results(fname):
+    '''Latest running means of every point in a results file, with their number of samples'''
+    results = {}
+    with open(fname) as f:
+        for line in f:
+            # Skip lines still being written
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            results[tuple(result['point'])] = (result['means'], result['samples'])
+    return results